@@ -0,0 +1,363 @@
+"""Out-of-process screen capture and encoding with a shared-memory frame ring."""
+import io
+import multiprocessing as mp
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+# Optional: CPU pinning on platforms without os.sched_setaffinity, and usage stats without /proc
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Ring header: latest published sequence, slot count, slot capacity, last reader poll time,
+# frames dropped for not fitting in a slot
+_HEADER = struct.Struct("<QIIdQ")
+# Slot header: sequence of the frame in the slot (0 while being written), frame length
+_SLOT = struct.Struct("<QI")
+
+
+class FrameRing:
+    """
+    Fixed-size ring of encoded frames in shared memory.
+
+    A single writer publishes frames with increasing sequence numbers. Readers
+    copy the newest frame and re-check the slot sequence afterwards, so a frame
+    overwritten mid-copy is discarded instead of returned torn.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        _, self.slots, self.slot_size, _, _ = _HEADER.unpack_from(self.buf, 0)
+        self.seq = self.latest_seq()
+
+    @classmethod
+    def create(cls, slots, slot_size):
+        """Allocate a new ring; the creator is responsible for unlinking it."""
+        size = _HEADER.size + slots * (_SLOT.size + slot_size)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, 0, slots, slot_size, 0.0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing ring by shared memory name."""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _slot_offset(self, seq):
+        return _HEADER.size + (seq % self.slots) * (_SLOT.size + self.slot_size)
+
+    def latest_seq(self):
+        """Sequence number of the newest published frame (0 if none)."""
+        return struct.unpack_from("<Q", self.buf, 0)[0]
+
+    def last_poll(self):
+        """Wall-clock time a reader last asked for a frame."""
+        return struct.unpack_from("<d", self.buf, 16)[0]
+
+    def dropped(self):
+        """Number of frames the writer dropped because they did not fit in a slot."""
+        return struct.unpack_from("<Q", self.buf, 24)[0]
+
+    def write(self, data):
+        """Publish a frame. Returns False (and counts a drop) if it does not fit in a slot."""
+        length = len(data)
+        if length > self.slot_size:
+            struct.pack_into("<Q", self.buf, 24, self.dropped() + 1)
+            return False
+        seq = self.seq + 1
+        offset = self._slot_offset(seq)
+        start = offset + _SLOT.size
+        _SLOT.pack_into(self.buf, offset, 0, length)
+        self.buf[start:start + length] = data
+        _SLOT.pack_into(self.buf, offset, seq, length)
+        struct.pack_into("<Q", self.buf, 0, seq)
+        self.seq = seq
+        return True
+
+    def read(self, after=0):
+        """
+        Return (seq, frame) for the newest frame newer than after,
+        or (after, None) if there is none or it was overwritten mid-read.
+        """
+        struct.pack_into("<d", self.buf, 16, time.time())
+        latest = self.latest_seq()
+        if latest <= after:
+            return after, None
+        offset = self._slot_offset(latest)
+        seq, length = _SLOT.unpack_from(self.buf, offset)
+        if seq != latest:
+            return after, None
+        start = offset + _SLOT.size
+        frame = bytes(self.buf[start:start + length])
+        if _SLOT.unpack_from(self.buf, offset)[0] != latest:
+            return after, None
+        return latest, frame
+
+    def close(self):
+        """Detach from the ring, unlinking it if this side created it."""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def pin_process(pid, cores):
+    """Restrict a process to the given CPU cores. Returns False if unsupported."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, cores)
+        return True
+    if psutil:
+        psutil.Process(pid).cpu_affinity(list(cores))
+        return True
+    return False
+
+
+def _proc_usage(pid):
+    """(cpu_seconds, rss_bytes) for pid from /proc, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+        with open(f"/proc/{pid}/statm", "rb") as f:
+            statm = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesised command name start at field 3 (state)
+    fields = stat[stat.rindex(b")") + 2:].split()
+    ticks = int(fields[11]) + int(fields[12])
+    cpu_seconds = ticks / os.sysconf("SC_CLK_TCK")
+    rss_bytes = int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss_bytes
+
+
+def _worker_main(shm_name, region, quality, idle_timeout, stop_event):
+    """Capture and encode frames into the ring until stopped (runs in the worker process)."""
+    import mss
+    from PIL import Image
+
+    ring = FrameRing.attach(shm_name)
+    try:
+        with mss.mss() as sct:
+            monitor = sct.monitors[region] if isinstance(region, int) else region
+            while not stop_event.is_set():
+                # Nobody is watching: don't burn CPU on encoding
+                if time.time() - ring.last_poll() > idle_timeout:
+                    time.sleep(0.01)
+                    continue
+
+                shot = sct.grab(monitor)
+                img = Image.frombytes('RGB', shot.size, shot.rgb)
+
+                buf = io.BytesIO()
+                img.save(buf, format='JPEG', quality=quality)
+                # Oversized frames are counted in the ring; the supervisor reports them
+                ring.write(buf.getbuffer())
+    finally:
+        ring.close()
+
+
+class CaptureWorker:
+    """Supervisor for a capture/encode process that publishes frames to a FrameRing."""
+
+    SLOTS = 4
+    SLOT_SIZE = 8 * 1024 * 1024
+    # Restart delay doubles after each quick crash, up to MAX_RESTART_DELAY
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 30.0
+    # A worker that ran this long before exiting resets the backoff
+    STABLE_AFTER = 10.0
+    IDLE_TIMEOUT = 1.0
+    POLL_INTERVAL = 0.002
+
+    def __init__(self, status_callback=None, region=1, quality=60, cores=None):
+        self.status_callback = status_callback
+        self.region = region
+        self.quality = quality
+        self.cores = cores
+        self.running = False
+        self.ring = None
+        self.process = None
+        self.restarts = 0
+        self.dropped_frames = 0
+        self._spawned_at = 0.0
+        self._ctx = mp.get_context("spawn")
+        self._stop_event = None
+        self._supervisor = None
+        # Readers currently inside the ring; stop() waits for them before closing it
+        self._readers = 0
+        self._ring_cond = threading.Condition()
+
+    def _update_status(self, message):
+        """Update status via callback if available."""
+        if self.status_callback:
+            self.status_callback(f"Capture Worker: {message}")
+
+    def _spawn(self):
+        """Start a fresh worker process attached to the ring."""
+        self.process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.ring.name, self.region, self.quality, self.IDLE_TIMEOUT, self._stop_event),
+            daemon=True,
+        )
+        self._spawned_at = time.monotonic()
+        self.process.start()
+        if self.cores:
+            try:
+                if not pin_process(self.process.pid, self.cores):
+                    self._update_status("CPU pinning is not supported on this platform")
+            except (OSError, ValueError) as e:
+                self._update_status(f"Could not pin worker to cores {sorted(self.cores)}: {e}")
+
+    def _check_dropped(self):
+        """Report frames the worker dropped since the last check."""
+        dropped = self._with_ring(lambda ring: ring.dropped())
+        if dropped is None or dropped == self.dropped_frames:
+            return
+        self._update_status(
+            f"Dropped {dropped - self.dropped_frames} frame(s) larger than the "
+            f"{self.SLOT_SIZE // (1024 * 1024)} MiB ring slot; lower the quality or capture a smaller region"
+        )
+        self.dropped_frames = dropped
+
+    def _supervise(self):
+        """Restart the worker process whenever it exits unexpectedly, backing off on repeated crashes."""
+        delay = self.RESTART_DELAY
+        while self.running:
+            self.process.join(0.5)
+            self._check_dropped()
+            if self.process.is_alive() or not self.running:
+                continue
+            if time.monotonic() - self._spawned_at >= self.STABLE_AFTER:
+                delay = self.RESTART_DELAY
+            self.restarts += 1
+            self._update_status(
+                f"Worker exited with code {self.process.exitcode}, restarting in {delay:g}s "
+                f"(restart #{self.restarts})"
+            )
+            # Returns early when stop() sets the event
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, self.MAX_RESTART_DELAY)
+            if self.running:
+                self._spawn()
+
+    def start(self):
+        """Allocate the frame ring and start the supervised worker."""
+        if self.running:
+            return
+        self.restarts = 0
+        self.dropped_frames = 0
+        self.ring = FrameRing.create(self.SLOTS, self.SLOT_SIZE)
+        try:
+            self._stop_event = self._ctx.Event()
+            self._spawn()
+        except Exception:
+            self.ring.close()
+            self.ring = None
+            raise
+        self.running = True
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        self._update_status(f"Started worker process (pid {self.process.pid})")
+
+    def _with_ring(self, fn):
+        """Call fn(ring) unless the worker is stopped; returns None once it is."""
+        with self._ring_cond:
+            if not self.running or self.ring is None:
+                return None
+            ring = self.ring
+            self._readers += 1
+        try:
+            return fn(ring)
+        finally:
+            with self._ring_cond:
+                self._readers -= 1
+                self._ring_cond.notify_all()
+
+    def frames(self):
+        """Yield each new encoded frame as the worker publishes it, until stopped."""
+        seq = 0
+        while True:
+            result = self._with_ring(lambda ring: ring.read(seq))
+            if result is None:
+                return
+            seq, frame = result
+            if frame is None:
+                time.sleep(self.POLL_INTERVAL)
+                continue
+            yield frame
+
+    def usage(self):
+        """CPU and memory usage of the worker process (via psutil, or /proc on Linux)."""
+        info = {
+            "pid": self.process.pid if self.process else None,
+            "restarts": self.restarts,
+            "dropped_frames": self.dropped_frames,
+        }
+        if not self.process or not self.process.is_alive():
+            return info
+        if psutil:
+            try:
+                proc = psutil.Process(self.process.pid)
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    info["cpu_seconds"] = times.user + times.system
+                    info["rss_bytes"] = proc.memory_info().rss
+            except psutil.Error:
+                pass
+        else:
+            usage = _proc_usage(self.process.pid)
+            if usage:
+                info["cpu_seconds"], info["rss_bytes"] = usage
+        return info
+
+    def next_frame(self, timeout=1.0):
+        """Return the next frame the worker publishes, or None on timeout."""
+        seq = self._with_ring(lambda ring: ring.latest_seq())
+        deadline = time.monotonic() + timeout
+        while seq is not None and time.monotonic() < deadline:
+            result = self._with_ring(lambda ring: ring.read(seq))
+            if result is None:
+                return None
+            seq, frame = result
+            if frame is not None:
+                return frame
+            time.sleep(self.POLL_INTERVAL)
+        return None
+
+    def stop(self):
+        """Stop the worker process and release the frame ring."""
+        with self._ring_cond:
+            if not self.running:
+                return
+            self.running = False
+        self._stop_event.set()
+        if self._supervisor:
+            self._supervisor.join(2)
+        if self.process:
+            self.process.join(2)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(1)
+
+        # No new readers can enter once running is False; wait out the ones inside
+        with self._ring_cond:
+            while self._readers:
+                self._ring_cond.wait()
+            ring, self.ring = self.ring, None
+        try:
+            ring.close()
+        except BufferError as e:
+            self._update_status(f"Could not release frame ring: {e}")
+        self._update_status("Worker stopped")
@@ -1,8 +1,10 @@
 """Client module for sending commands to server."""
+import os
 import socket
 import sys
 import threading
 import platform
+import time
 
 # Platform-specific imports
 if platform.system() != 'Windows':
@@ -18,32 +20,90 @@ class CommandClient:
     
     PORT = 5001
     
-    def __init__(self, server_ip, status_callback=None, use_gui=False):
+    # Analog motion events: ESC 'M' <axis char> <4 hex digits>, see GamepadServer
+    MOTION_PREFIX = "\x1bM"
+    
+    # Timestamp for the events that follow: ESC 'T' <12 hex digits, microseconds>
+    TIME_PREFIX = "\x1bT"
+    
+    # Axis names to wire characters
+    AXIS_CODES = {
+        "left_x": "x",
+        "left_y": "y",
+        "right_x": "X",
+        "right_y": "Y",
+        "left_trigger": "l",
+        "right_trigger": "r",
+    }
+    
+    # How often pending analog motion is sent to the server
+    MOTION_RATE_HZ = 250
+    
+    def __init__(self, server_ip, status_callback=None, use_gui=False, motion_rate=None, timestamps=False):
         self.server_ip = server_ip
         self.status_callback = status_callback
         self.running = False
         self.socket = None
         self.old_settings = None
         self.use_gui = use_gui
+        self.motion_rate = motion_rate or self.MOTION_RATE_HZ
+        self.timestamps = timestamps
         self.pending_chars = []
+        self.pending_axes = {}
         self.char_lock = threading.Lock()
+        self.motion_thread = None
     
     def _update_status(self, message):
         """Update status via callback if available."""
         if self.status_callback:
             self.status_callback(f"Client: {message}")
     
+    def _stamp(self, payload):
+        """Prefix payload with the current client time when timestamps are enabled."""
+        if not self.timestamps:
+            return payload
+        now_us = int(time.monotonic() * 1e6) & 0xFFFFFFFFFFFF
+        return f"{self.TIME_PREFIX}{now_us:012x}{payload}"
+    
     def send_char(self, char):
-        """Send a character to the server (for GUI mode)."""
+        """
+        Send a character (or a whole escape sequence) to the server (for GUI mode).
+        Multi-byte key sequences must be sent in one call so they share one timestamp.
+        """
         if self.socket and self.running:
             try:
-                self.socket.send(char.encode())
-                if ord(char) == 3:  # Ctrl+C
+                self.socket.sendall(self._stamp(char).encode())
+                if char == "\x03":  # Ctrl+C
                     self._update_status("Disconnecting...")
                     self.stop()
             except Exception as e:
                 self._update_status(f"Error sending char: {e}")
     
+    def send_axis(self, axis, value):
+        """Queue an analog axis value; only the newest value per axis is sent."""
+        with self.char_lock:
+            self.pending_axes[axis] = int(value)
+    
+    def _encode_motion(self, axis, value):
+        """Encode one axis value as a motion escape sequence."""
+        value = max(-32768, min(32767, value))
+        return f"{self.MOTION_PREFIX}{self.AXIS_CODES[axis]}{value & 0xFFFF:04x}"
+    
+    def _motion_loop(self):
+        """Send coalesced analog motion at the configured rate."""
+        interval = 1.0 / self.motion_rate
+        while self.running:
+            with self.char_lock:
+                pending, self.pending_axes = self.pending_axes, {}
+            if pending and self.socket:
+                payload = "".join(self._encode_motion(axis, value) for axis, value in pending.items())
+                try:
+                    self.socket.sendall(self._stamp(payload).encode())
+                except Exception as e:
+                    self._update_status(f"Error sending motion: {e}")
+                    break
+            time.sleep(interval)
+    
     def _run_terminal_mode(self):
         """Run client in terminal mode (original behavior - Unix only)."""
         if platform.system() == 'Windows':
@@ -66,9 +126,12 @@ class CommandClient:
                     tty.setraw(sys.stdin.fileno())
             
             while self.running:
-                char = sys.stdin.read(1)
-                self.socket.send(char.encode())
-                if ord(char) == 3:  # Ctrl+C
+                # A key's escape sequence arrives in one read, so it gets one timestamp
+                chars = os.read(sys.stdin.fileno(), 64).decode(errors="ignore")
+                if not chars:
+                    break
+                self.socket.sendall(self._stamp(chars).encode())
+                if "\x03" in chars:  # Ctrl+C
                     self._update_status("Disconnecting...")
                     break
                     
@@ -87,6 +150,8 @@ class CommandClient:
             self.socket.connect((self.server_ip, self.PORT))
             self._update_status(f"Connected to {self.server_ip}:{self.PORT}")
             self._update_status("Ready to send commands. Use keyboard input in GUI.")
+            self.motion_thread = threading.Thread(target=self._motion_loop, daemon=True)
+            self.motion_thread.start()
         except ConnectionRefusedError:
             self._update_status(f"Connection refused. Is server running at {self.server_ip}?")
             self.running = False
@@ -1,10 +1,11 @@
 """Main GUI application for server and client modes."""
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import threading
 from utils import get_local_ip
 from server_modules import GamepadServer, StreamServer
 from client_modules import CommandClient
+from tracing import tracer
 
 
 class Application:
@@ -70,6 +71,27 @@ class Application:
         self.server_ip_label = ttk.Label(ip_frame, text="Not started", font=("Arial", 10, "bold"))
         self.server_ip_label.pack(side=tk.LEFT, padx=10)
         
+        # Capture/encode in a separate process to keep it off the input and UI threads
+        self.worker_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.server_frame,
+            text="Capture and encode in a separate process",
+            variable=self.worker_var
+        ).pack(anchor=tk.W, pady=5)
+        
+        # Schedule timestamped client input at a consistent delay
+        jitter_frame = ttk.Frame(self.server_frame)
+        jitter_frame.pack(fill=tk.X, pady=5)
+        
+        self.jitter_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            jitter_frame,
+            text="Input jitter buffer",
+            variable=self.jitter_var
+        ).pack(side=tk.LEFT)
+        self.jitter_label = ttk.Label(jitter_frame, text="", foreground="gray")
+        self.jitter_label.pack(side=tk.LEFT, padx=10)
+        
         # Status display for server
         ttk.Label(self.server_frame, text="Status:").pack(anchor=tk.W, pady=(10, 5))
         self.server_status = scrolledtext.ScrolledText(
@@ -99,6 +121,21 @@ class Application:
         )
         self.server_stop_btn.pack(side=tk.LEFT, padx=5)
         
+        # Tracing can be toggled while the servers run
+        self.trace_var = tk.BooleanVar(value=tracer.enabled)
+        ttk.Checkbutton(
+            server_btn_frame,
+            text="Trace",
+            variable=self.trace_var,
+            command=self._toggle_tracing
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Button(
+            server_btn_frame,
+            text="Export Trace...",
+            command=self._export_trace
+        ).pack(side=tk.LEFT, padx=5)
+        
         # Client mode frame
         self.client_frame = ttk.LabelFrame(self.root, text="Client Mode", padding=10)
         
@@ -118,6 +155,14 @@ class Application:
         self.client_ip_display = ttk.Label(display_frame, text="Not connected", font=("Arial", 10, "bold"))
         self.client_ip_display.pack(side=tk.LEFT, padx=10)
         
+        # Timestamps let a server-side jitter buffer smooth out network jitter
+        self.timestamps_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.client_frame,
+            text="Timestamp input (for server jitter buffer)",
+            variable=self.timestamps_var
+        ).pack(anchor=tk.W, pady=5)
+        
         # Status display for client
         ttk.Label(self.client_frame, text="Status:").pack(anchor=tk.W, pady=(10, 5))
         self.client_status = scrolledtext.ScrolledText(
@@ -201,12 +246,24 @@ class Application:
         self.local_ip = get_local_ip()
         self.server_ip_label.config(text=self.local_ip)
         
-        # Create servers with status callbacks
-        self.gamepad_server = GamepadServer(status_callback=self._log_server_status)
-        self.stream_server = StreamServer(status_callback=self._log_server_status)
-        
-        # Start stream server in a thread
-        self.stream_server.start()
+        try:
+            # Create servers with status callbacks
+            self.gamepad_server = GamepadServer(
+                status_callback=self._log_server_status,
+                jitter_buffer=self.jitter_var.get()
+            )
+            self.stream_server = StreamServer(
+                status_callback=self._log_server_status,
+                use_worker=self.worker_var.get()
+            )
+            
+            # Bind both ports up front so failures are reported here
+            self.gamepad_server.listen()
+            self.stream_server.start()
+        except Exception as e:
+            self._log_server_status(f"Could not start servers: {e}")
+            self._stop_server()
+            return
         self._log_server_status("Stream server starting...")
         
         # Start gamepad server in a thread
@@ -218,6 +275,10 @@ class Application:
         self._log_server_status(f"Server IP: {self.local_ip}")
         self._log_server_status(f"Stream available at: http://{self.local_ip}:8000")
         self._log_server_status(f"Gamepad server listening on port 5001")
+        
+        if self.jitter_var.get():
+            self._update_jitter_stats()
+        self._sync_trace_var()
     
     def _stop_server(self):
         """Stop both servers."""
@@ -236,6 +297,52 @@ class Application:
         self.server_ip_label.config(text="Not started")
         self._log_server_status("Servers stopped.")
     
+    def _update_jitter_stats(self):
+        """Refresh the jitter buffer statistics once per second while serving."""
+        if not self.server_running or not self.gamepad_server:
+            self.jitter_label.config(text="")
+            return
+        
+        stats = self.gamepad_server.jitter_stats()
+        if stats:
+            self.jitter_label.config(
+                text=f"Delay {stats['delay_ms']:.1f} ms, jitter {stats['jitter_ms']:.1f} ms, "
+                     f"late drops {stats['late_drops']}"
+            )
+        self.root.after(1000, self._update_jitter_stats)
+    
+    def _sync_trace_var(self):
+        """Keep the Trace checkbox in step with /trace/start and /trace/stop while serving."""
+        if self.trace_var.get() != tracer.enabled:
+            self.trace_var.set(tracer.enabled)
+        if self.server_running:
+            self.root.after(500, self._sync_trace_var)
+    
+    def _toggle_tracing(self):
+        """Enable or disable span tracing."""
+        if self.trace_var.get():
+            tracer.start()
+            self._log_server_status("Tracing enabled")
+        else:
+            tracer.stop()
+            self._log_server_status("Tracing disabled")
+    
+    def _export_trace(self):
+        """Save recorded spans as a Chrome trace file."""
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json")],
+            initialfile="trace.json"
+        )
+        if not path:
+            return
+        
+        try:
+            tracer.save(path)
+            self._log_server_status(f"Trace saved to {path}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save trace: {e}")
+    
     def _start_client(self):
         """Start the client."""
         if self.client_running:
@@ -259,7 +366,12 @@ class Application:
         self.client_ip_display.config(text=server_ip)
         
         # Create and start client in GUI mode
-        self.client = CommandClient(server_ip, status_callback=self._log_client_status, use_gui=True)
+        self.client = CommandClient(
+            server_ip,
+            status_callback=self._log_client_status,
+            use_gui=True,
+            timestamps=self.timestamps_var.get()
+        )
         self.client_thread = threading.Thread(target=self.client.start, daemon=True)
         self.client_thread.start()
         
@@ -298,6 +410,15 @@ class Application:
         self.client_input_window.bind("<KeyPress>", self._on_client_key_press)
         self.client_input_field.bind("<KeyPress>", self._on_client_key_press)
         
+        # Mouse position drives the right stick (left stick while Shift is held),
+        # mouse buttons drive the triggers
+        self.client_input_field.bind("<Motion>", self._on_client_motion)
+        self.client_input_field.bind("<Leave>", self._on_client_leave)
+        self.client_input_field.bind("<ButtonPress-1>", lambda e: self._on_client_trigger("left_trigger", 255))
+        self.client_input_field.bind("<ButtonRelease-1>", lambda e: self._on_client_trigger("left_trigger", 0))
+        self.client_input_field.bind("<ButtonPress-3>", lambda e: self._on_client_trigger("right_trigger", 255))
+        self.client_input_field.bind("<ButtonRelease-3>", lambda e: self._on_client_trigger("right_trigger", 0))
+        
         # Handle window close
         self.client_input_window.protocol("WM_DELETE_WINDOW", self._close_client_input_window)
         
@@ -310,30 +431,14 @@ class Application:
         
         char = None
         
-        # Handle arrow keys (escape sequences)
-        if event.keysym == "Up":
-            # Send escape sequence: ESC [ A
-            self.client.send_char("\x1b")
-            self.client.send_char("[")
-            self.client.send_char("A")
-            return "break"
-        elif event.keysym == "Down":
-            self.client.send_char("\x1b")
-            self.client.send_char("[")
-            self.client.send_char("B")
-            return "break"
-        elif event.keysym == "Right":
-            self.client.send_char("\x1b")
-            self.client.send_char("[")
-            self.client.send_char("C")
-            return "break"
-        elif event.keysym == "Left":
-            self.client.send_char("\x1b")
-            self.client.send_char("[")
-            self.client.send_char("D")
+        # Handle arrow keys (escape sequences), sent whole so they stay one event
+        arrows = {"Up": "\x1b[A", "Down": "\x1b[B", "Right": "\x1b[C", "Left": "\x1b[D"}
+        if event.keysym in arrows:
+            self.client.send_char(arrows[event.keysym])
             return "break"
+        
         # Handle other special keys
-        elif event.keysym == "Return":
+        if event.keysym == "Return":
             char = "\n"
         elif event.keysym == "BackSpace":
             char = "\b"
@@ -363,6 +468,39 @@ class Application:
         # Don't insert the character in the text field
         return "break"
     
+    def _on_client_motion(self, event):
+        """Map mouse position in the input field to the right stick, or the left stick with Shift."""
+        if not self.client or not self.client_running:
+            return
+        
+        half_w = max(event.widget.winfo_width() / 2, 1)
+        half_h = max(event.widget.winfo_height() / 2, 1)
+        x = max(-1.0, min(1.0, (event.x - half_w) / half_w))
+        y = max(-1.0, min(1.0, (half_h - event.y) / half_h))
+        
+        # The stick the mouse is not driving returns to center
+        active, idle = ("left", "right") if event.state & 0x1 else ("right", "left")
+        self.client.send_axis(f"{active}_x", x * 32767)
+        self.client.send_axis(f"{active}_y", y * 32767)
+        self.client.send_axis(f"{idle}_x", 0)
+        self.client.send_axis(f"{idle}_y", 0)
+    
+    def _on_client_leave(self, event):
+        """Re-center both sticks when the mouse leaves the input field."""
+        if not self.client or not self.client_running:
+            return
+        
+        for axis in ("left_x", "left_y", "right_x", "right_y"):
+            self.client.send_axis(axis, 0)
+    
+    def _on_client_trigger(self, axis, value):
+        """Send a trigger value from a mouse button."""
+        if not self.client or not self.client_running:
+            return "break"
+        
+        self.client.send_axis(axis, value)
+        return "break"
+    
     def _close_client_input_window(self):
         """Close the client input window."""
         if self.client_input_window:
@@ -0,0 +1,264 @@
+"""Precompiled decoder for the terminal-style input protocol."""
+import json
+import re
+
+
+# Analog motion events: ESC 'M' <axis char> <4 hex digits, 16-bit two's complement>
+MOTION_PREFIX = "\x1bM"
+MOTION_BODY_LEN = 1 + 4
+
+# Client timestamps for the events that follow: ESC 'T' <12 hex digits, microseconds>
+TIME_PREFIX = "\x1bT"
+TIME_BODY_LEN = 12
+
+# Decoder events that are not gamepad actions from the key profile
+QUIT = ("quit", None)
+AXIS = "axis"
+TIME = "time"
+
+
+class _Payload:
+    """Trie leaf for an escape sequence followed by a fixed-length body."""
+
+    __slots__ = ("length", "decode")
+
+    def __init__(self, length, decode):
+        self.length = length
+        self.decode = decode
+
+
+def load_profile(path):
+    """
+    Load a key-mapping profile from a JSON file.
+
+    The profile has a "keys" object mapping single characters to actions and an
+    optional "escapes" object mapping escape sequences to actions. Actions are
+    strings such as "button A" or "dpad up".
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    validate_profile(profile)
+    return profile
+
+
+def validate_profile(profile):
+    """Check the shape of a key-mapping profile, raising ValueError if it is invalid."""
+    if not isinstance(profile, dict):
+        raise ValueError("Key-mapping profile must be a JSON object")
+    for section in ("keys", "escapes"):
+        entries = profile.get(section, {})
+        if not isinstance(entries, dict):
+            raise ValueError(f"Profile section {section!r} must be an object")
+        for seq, action in entries.items():
+            if not isinstance(action, str):
+                raise ValueError(f"Action for {seq!r} must be a string, got {action!r}")
+    for ch in profile.get("keys", {}):
+        if len(ch) != 1:
+            raise ValueError(f"Key {ch!r} must be a single character")
+
+
+class InputDecoder:
+    """
+    Decode raw input bytes into batches of gamepad events.
+
+    Plain bytes are resolved through a 256-entry dispatch table. Runs of plain
+    bytes and complete escape sequences are matched a whole token at a time
+    by one compiled regex; escape sequences that are split across recv
+    buffers or malformed fall back to walking a byte trie compiled from the
+    escape map. Decoder state persists between calls, so split sequences
+    decode correctly.
+    """
+
+    def __init__(self, char_map, esc_map, axis_map):
+        self._axis_map = {ord(ch): axis for ch, axis in axis_map.items()}
+        self._table = self._compile_table(char_map)
+        payloads = {
+            MOTION_PREFIX: _Payload(MOTION_BODY_LEN, self._decode_motion),
+            TIME_PREFIX: _Payload(TIME_BODY_LEN, self._decode_time),
+        }
+        self._table[0x1B] = self._compile_escapes(esc_map, payloads)
+        self._tokens, self._token_re = self._compile_tokens(esc_map, payloads)
+        self.reset()
+
+    @staticmethod
+    def _compile_table(char_map):
+        """Build the dispatch table for bytes outside an escape sequence."""
+        table = [None] * 256
+        for ch, action in char_map.items():
+            if not isinstance(ch, str) or len(ch) != 1 or ord(ch) > 0xFF:
+                raise ValueError(f"Key {ch!r} is not a single-byte character")
+            if ch in ("\x03", "\x1b"):
+                raise ValueError(f"Key {ch!r} is reserved (Ctrl+C / escape sequences)")
+            table[ord(ch)] = action
+        return table
+
+    @staticmethod
+    def _compile_escapes(esc_map, payloads):
+        """Build a byte trie for escape sequences, including payload prefixes."""
+        for seq in esc_map:
+            if not isinstance(seq, str) or not seq.startswith("\x1b") or len(seq) < 2:
+                raise ValueError(f"Escape sequence {seq!r} must start with ESC")
+            if "\x03" in seq or "\x1b" in seq[1:]:
+                raise ValueError(f"Escape sequence {seq!r} contains a reserved byte")
+            if any(ord(ch) > 0xFF for ch in seq):
+                raise ValueError(f"Escape sequence {seq!r} is not single-byte text")
+
+        sequences = dict(esc_map)
+        sequences.update(payloads)
+        if len(sequences) != len(esc_map) + len(payloads):
+            raise ValueError("Escape sequences must not use the reserved ESC M / ESC T prefixes")
+
+        # After sorting, a sequence that prefixes another sorts directly before one that extends it
+        ordered = sorted(sequences)
+        for shorter, longer in zip(ordered, ordered[1:]):
+            if longer.startswith(shorter):
+                raise ValueError(f"Escape sequence {shorter!r} is a prefix of {longer!r}")
+
+        root = {}
+        for seq, action in sequences.items():
+            node = root
+            encoded = seq[1:].encode("latin-1")
+            for b in encoded[:-1]:
+                node = node.setdefault(b, {})
+            node[encoded[-1]] = action
+        return root
+
+    @staticmethod
+    def _compile_tokens(esc_map, payloads):
+        """
+        Build a regex matching a run of plain bytes or one complete escape sequence.
+        Returns (tokens, regex), where tokens[match.lastindex] is (entry, prefix_len):
+        entry is None for a plain run, and prefix_len is non-zero for payloads.
+        """
+        tokens = [None, (None, 0)]
+        alternatives = [b"([^\x1b]+)"]
+        for seq, action in esc_map.items():
+            tokens.append((action, 0))
+            alternatives.append(b"(" + re.escape(seq.encode("latin-1")) + b")")
+        for prefix, payload in payloads.items():
+            encoded = prefix.encode("latin-1")
+            tokens.append((payload, len(encoded)))
+            alternatives.append(
+                b"(" + re.escape(encoded) + b"[^\x1b]{%d})" % payload.length
+            )
+        return tokens, re.compile(b"|".join(alternatives))
+
+    def reset(self):
+        """Drop any partially decoded escape or payload sequence."""
+        self._node = None
+        self._payload = None
+        self._body = None
+
+    def feed(self, data):
+        """
+        Decode a buffer of bytes.
+        Returns a list of (kind, value) events in arrival order. Decoding stops
+        at a Ctrl+C byte, which is reported as QUIT.
+        """
+        events = []
+        table = self._table
+        node = self._node
+        payload = self._payload
+        body = self._body
+        pos = 0
+        end = len(data)
+
+        # Ctrl+C always wins, even in the middle of a sequence
+        quit_at = data.find(b"\x03")
+        if quit_at != -1:
+            end = quit_at
+
+        tokens = self._tokens
+        iter_tokens = self._token_re.finditer
+        append = events.append
+
+        while pos < end:
+            if node is None:
+                # Whole tokens at a time, up to an escape sequence the regex cannot match
+                for match in iter_tokens(data, pos, end):
+                    if match.start() != pos:
+                        break
+                    entry, prefix_len = tokens[match.lastindex]
+                    stop = match.end()
+                    if entry is None:
+                        # Plain bytes go straight through the table
+                        events.extend(filter(None, map(table.__getitem__, data[pos:stop])))
+                    elif prefix_len:
+                        event = entry.decode(data[pos + prefix_len:stop])
+                        if event:
+                            append(event)
+                    else:
+                        append(entry)
+                    pos = stop
+                if pos < end:
+                    # An escape sequence that is split, unknown or malformed: walk the trie
+                    node = table[0x1B]
+                    pos += 1
+                continue
+
+            if payload is not None:
+                take = min(payload.length - len(body), end - pos)
+                chunk = data[pos:pos + take]
+                # Bodies are plain hex: an ESC means the body was cut short, restart on it
+                restart = chunk.find(b"\x1b")
+                if restart != -1:
+                    node = table[0x1B]
+                    payload = None
+                    body = None
+                    pos += restart + 1
+                    continue
+                body += chunk
+                pos += take
+                if len(body) == payload.length:
+                    event = payload.decode(body)
+                    if event:
+                        events.append(event)
+                    node = None
+                    payload = None
+                    body = None
+                continue
+
+            b = data[pos]
+            entry = node.get(b)
+            pos += 1
+            if entry is None:
+                # A new ESC abandons the unfinished sequence and starts another
+                node = table[0x1B] if b == 0x1B else None
+            elif entry.__class__ is _Payload:
+                payload = entry
+                body = bytearray()
+            elif entry.__class__ is dict:
+                node = entry
+            else:
+                events.append(entry)
+                node = None
+
+        if quit_at != -1:
+            events.append(QUIT)
+            self.reset()
+            return events
+
+        self._node = node
+        self._payload = payload
+        self._body = body
+        return events
+
+    def _decode_motion(self, body):
+        """Decode a motion body into an axis event, or None if malformed."""
+        axis = self._axis_map.get(body[0])
+        if axis is None:
+            return None
+        try:
+            raw = int(body[1:], 16)
+        except ValueError:
+            return None
+        value = raw - 0x10000 if raw & 0x8000 else raw
+        return (AXIS, (axis, value))
+
+    @staticmethod
+    def _decode_time(body):
+        """Decode a timestamp body into a time event, or None if malformed."""
+        try:
+            return (TIME, int(body, 16))
+        except ValueError:
+            return None
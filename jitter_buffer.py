@@ -0,0 +1,141 @@
+"""Server-side jitter buffer for timestamped client input."""
+import collections
+import heapq
+import threading
+import time
+
+
+class JitterBuffer:
+    """
+    Apply timestamped events at a consistent delay after the client sent them.
+
+    The clock offset is estimated as the minimum of (arrival time - client
+    timestamp) over a sliding window, so the fastest recent packet defines
+    zero transit. The playout delay tracks a high percentile of the measured
+    transit jitter; events arriving after their playout time are dropped.
+    """
+
+    MIN_DELAY = 0.004
+    MAX_DELAY = 0.150
+    MARGIN = 0.002
+    WINDOW = 512
+    PERCENTILE = 0.95
+    ADAPT_EVERY = 32
+    # Below this, sleep instead of waiting on the condition (its timeout is coarse on some platforms)
+    FINE_WAIT = 0.002
+
+    def __init__(self, apply_callback, min_delay=None, max_delay=None):
+        self.apply_callback = apply_callback
+        self.min_delay = self.MIN_DELAY if min_delay is None else min_delay
+        self.max_delay = self.MAX_DELAY if max_delay is None else max_delay
+        self.running = False
+        self.thread = None
+        self._cond = threading.Condition()
+        self._heap = []
+        self._counter = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the clock estimate and pending events (e.g. on a new connection)."""
+        with self._cond:
+            self._heap.clear()
+            self._samples = collections.deque(maxlen=self.WINDOW)
+            self._pushes = 0
+            self._last_target = 0.0
+            self.offset = None
+            self.jitter = 0.0
+            self.delay = self.min_delay
+            self.late_drops = 0
+            self.applied = 0
+
+    def _adapt(self):
+        """Re-estimate clock offset and playout delay from the sample window."""
+        self.offset = min(self._samples)
+        transits = sorted(sample - self.offset for sample in self._samples)
+        self.jitter = transits[int(self.PERCENTILE * (len(transits) - 1))]
+        self.delay = max(self.min_delay, min(self.max_delay, self.jitter + self.MARGIN))
+
+    def push(self, client_us, events):
+        """
+        Schedule events stamped with the client time client_us (microseconds).
+        Returns False if they arrived too late and were dropped.
+        """
+        now = time.monotonic()
+        client_time = client_us / 1e6
+        sample = now - client_time
+        with self._cond:
+            self._samples.append(sample)
+            if self.offset is None or sample < self.offset:
+                self.offset = sample
+            self._pushes += 1
+            # Adapt on every event while warming up, then periodically
+            if self._pushes <= self.ADAPT_EVERY or self._pushes % self.ADAPT_EVERY == 0:
+                self._adapt()
+
+            target = client_time + self.offset + self.delay
+            if target < now:
+                self.late_drops += len(events)
+                return False
+
+            # Never reorder: a shrinking delay must not overtake queued events
+            target = max(target, self._last_target)
+            self._last_target = target
+            self._counter += 1
+            heapq.heappush(self._heap, (target, self._counter, events))
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        """Release queued events when their playout time arrives."""
+        while self.running:
+            due = None
+            with self._cond:
+                if not self._heap:
+                    self._cond.wait(0.5)
+                    continue
+                remaining = self._heap[0][0] - time.monotonic()
+                if remaining > self.FINE_WAIT:
+                    self._cond.wait(remaining - self.FINE_WAIT)
+                    continue
+                if remaining <= 0:
+                    now = time.monotonic()
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due.extend(heapq.heappop(self._heap)[2])
+                    self.applied += len(due)
+
+            if due:
+                self.apply_callback(due)
+            elif remaining > 0:
+                # push() never schedules ahead of queued events, so nothing can become
+                # due before the head: sleep out the last stretch without holding the lock
+                time.sleep(remaining)
+
+    def start(self):
+        """Start the playout thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the playout thread, discarding queued events."""
+        self.running = False
+        with self._cond:
+            self._heap.clear()
+            self._cond.notify()
+        # A restart must not leave the old playout thread running alongside the new one
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(1)
+
+    def stats(self):
+        """Current added delay, measured jitter and event counters."""
+        with self._cond:
+            return {
+                "delay_ms": self.delay * 1000,
+                "jitter_ms": self.jitter * 1000,
+                "queued": sum(len(item[2]) for item in self._heap),
+                "applied": self.applied,
+                "late_drops": self.late_drops,
+            }
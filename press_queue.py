@@ -0,0 +1,70 @@
+"""Ordered, non-blocking button taps for the virtual gamepad."""
+import queue
+import threading
+import time
+
+
+class PressQueue:
+    """
+    Apply queued button taps one after another on a worker thread.
+
+    Each tap presses a button, holds it for the tap duration and releases it
+    before the next tap starts, so callers never block on press timing and
+    repeated taps of one button always stay separate presses.
+    """
+
+    DURATION = 0.05
+
+    def __init__(self, set_button, duration=None):
+        # set_button(btn, pressed) applies one press/release and returns False on failure
+        self.set_button = set_button
+        self.duration = self.DURATION if duration is None else duration
+        self.thread = None
+        self._queue = None
+
+    def put(self, buttons):
+        """Queue taps for buttons, in order."""
+        q = self._queue
+        if q is None:
+            return
+        for btn in buttons:
+            q.put(btn)
+
+    def pending(self):
+        """Number of taps waiting to be applied."""
+        q = self._queue
+        return q.qsize() if q else 0
+
+    def _run(self, q):
+        """Apply taps from q until stop() hands it the None sentinel."""
+        while True:
+            btn = q.get()
+            if btn is None:
+                return
+            if self.set_button(btn, True):
+                time.sleep(self.duration)
+                self.set_button(btn, False)
+
+    def start(self):
+        """Start the worker thread with an empty queue."""
+        if self.thread:
+            return
+        # Each run gets its own queue, so a restart never shares taps with an old worker
+        self._queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Discard pending taps and stop the worker once its current tap is released."""
+        q, self._queue = self._queue, None
+        thread, self.thread = self.thread, None
+        if q is None:
+            return
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+        q.put(None)
+        if thread is not threading.current_thread():
+            thread.join(self.duration + 1)
@@ -1,4 +1,7 @@
 """Server modules for gamepad control and streaming."""
+import hashlib
+import os
+import platform
 import socket
 import time
 import vgamepad as vg
@@ -6,7 +9,13 @@ import io
 import mss
 import threading
 from PIL import Image
-from flask import Flask, Response
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
+from input_decoder import InputDecoder, load_profile, validate_profile, AXIS, QUIT, TIME
+from jitter_buffer import JitterBuffer
+from press_queue import PressQueue
+from capture_worker import CaptureWorker
+from tracing import tracer
 
 
 class GamepadServer:
@@ -17,10 +26,10 @@ class GamepadServer:
     
     # Arrow escape sequences from Linux terminal
     ESC_MAP = {
-        "\x1b[A": "up",
-        "\x1b[B": "down",
-        "\x1b[C": "right",
-        "\x1b[D": "left",
+        "\x1b[A": ("dpad", "up"),
+        "\x1b[B": ("dpad", "down"),
+        "\x1b[C": ("dpad", "right"),
+        "\x1b[D": ("dpad", "left"),
     }
     
     # Character to gamepad mapping
@@ -43,105 +52,295 @@ class GamepadServer:
         "right": vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT,
     }
     
-    def __init__(self, status_callback=None):
+    # Optional key-mapping profile picked up when no profile is passed in
+    PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gamepad_profile.json")
+    
+    # Axis character in motion events to analog control
+    AXIS_MAP = {
+        "x": "left_x",
+        "y": "left_y",
+        "X": "right_x",
+        "Y": "right_y",
+        "l": "left_trigger",
+        "r": "right_trigger",
+    }
+    
+    # How often coalesced analog state is pushed to the virtual gamepad
+    UPDATE_RATE_HZ = 125
+    
+    def __init__(self, status_callback=None, update_rate=None, profile=None, jitter_buffer=False,
+                 port=None):
         self.status_callback = status_callback
+        self.port = port or self.PORT
+        self.update_rate = update_rate or self.UPDATE_RATE_HZ
         self.running = False
         self.socket = None
         self.conn = None
+        self.client_addr = None
         self.gamepad = None
-        self.esc_buf = ""
+        self.gamepad_lock = threading.Lock()
+        self.decoder = self._build_decoder(profile)
+        
+        # Button taps are applied in order off the recv thread
+        self.presses = PressQueue(self._set_button)
+        
+        # Newest value per axis since the last update tick
+        self.pending_axes = {}
+        self.axis_lock = threading.Lock()
+        self.axis_state = {axis: 0 for axis in self.AXIS_MAP.values()}
+        self.update_thread = None
+        
+        # Timestamped input is scheduled through the jitter buffer when enabled
+        self.jitter = JitterBuffer(self._apply_scheduled) if jitter_buffer else None
+        self.stamp = None
         
     def _update_status(self, message):
         """Update status via callback if available."""
         if self.status_callback:
             self.status_callback(f"Gamepad Server: {message}")
     
+    def _resolve_action(self, spec):
+        """Resolve a profile action such as "button A" or "dpad up"."""
+        kind, _, name = spec.strip().partition(" ")
+        name = name.strip()
+        if kind == "dpad" and name in self.DPAD_MAP:
+            return ("dpad", name)
+        if kind == "button":
+            button = getattr(vg.XUSB_BUTTON, f"XUSB_GAMEPAD_{name.upper()}", None)
+            if button is not None:
+                return ("button", button)
+        raise ValueError(f"Unknown gamepad action in profile: {spec!r}")
+    
+    def _build_decoder(self, profile):
+        """
+        Compile the input decoder from a key-mapping profile.
+        profile may be a dict, a path to a JSON profile, or None to use
+        PROFILE_PATH if it exists and the built-in mapping otherwise.
+        """
+        if profile is None and os.path.exists(self.PROFILE_PATH):
+            try:
+                return self._build_decoder(self.PROFILE_PATH)
+            except (OSError, ValueError) as e:
+                self._update_status(f"Ignoring profile {self.PROFILE_PATH}: {e}")
+        
+        if profile is None:
+            return InputDecoder(self.CHAR_MAP, self.ESC_MAP, self.AXIS_MAP)
+        
+        if isinstance(profile, str):
+            profile = load_profile(profile)
+        else:
+            validate_profile(profile)
+        char_map = {ch: self._resolve_action(spec) for ch, spec in profile.get("keys", {}).items()}
+        esc_map = {seq: self._resolve_action(spec) for seq, spec in profile.get("escapes", {}).items()}
+        return InputDecoder(char_map, esc_map, self.AXIS_MAP)
+    
     def press_gamepad_action(self, kind, value, duration=0.05):
         """Press a gamepad button/dpad briefly."""
+        btn = self._button_for(kind, value)
+        if btn is None:
+            return
+        if not self._set_button(btn, pressed=True):
+            return
+        time.sleep(duration)
+        self._set_button(btn, pressed=False)
+    
+    def press_gamepad_actions(self, actions, duration=0.05):
+        """Press a batch of decoded gamepad buttons/dpad directions one after another."""
+        for kind, value in actions:
+            self.press_gamepad_action(kind, value, duration)
+    
+    def queue_gamepad_actions(self, actions):
+        """Queue a batch of decoded gamepad buttons/dpad directions without blocking."""
+        buttons = (self._button_for(kind, value) for kind, value in actions)
+        self.presses.put(btn for btn in buttons if btn is not None)
+    
+    def _button_for(self, kind, value):
+        """Map a decoded action to its XUSB button, or None if it is not a press."""
+        if kind == "button":
+            return value
+        if kind == "dpad":
+            return self.DPAD_MAP[value]
+        return None
+    
+    def _set_button(self, btn, pressed):
+        """Press or release a button and push the change to the gamepad."""
         try:
-            if kind == "button":
-                self.gamepad.press_button(button=value)
-                self.gamepad.update()
-                time.sleep(duration)
-                self.gamepad.release_button(button=value)
-                self.gamepad.update()
-            elif kind == "dpad":
-                btn = self.DPAD_MAP[value]
-                self.gamepad.press_button(button=btn)
+            with self.gamepad_lock:
+                if pressed:
+                    self.gamepad.press_button(button=btn)
+                else:
+                    self.gamepad.release_button(button=btn)
                 self.gamepad.update()
-                time.sleep(duration)
-                self.gamepad.release_button(button=btn)
+            return True
+        except Exception as e:
+            self._update_status(f"Error sending gamepad action {btn}: {e}")
+            return False
+    
+    def _apply_scheduled(self, events):
+        """Apply events released by the jitter buffer."""
+        actions = []
+        for event in events:
+            kind, value = event
+            if kind == AXIS:
+                self.set_axis(*value)
+            else:
+                actions.append(event)
+        if actions:
+            # Same queue as direct input: a tap never starts before the previous one is released
+            with tracer.span("queue_gamepad_actions", "input"):
+                self.queue_gamepad_actions(actions)
+    
+    def jitter_stats(self):
+        """Jitter buffer delay and drop statistics, or None when it is disabled."""
+        return self.jitter.stats() if self.jitter else None
+    
+    def set_axis(self, axis, value):
+        """Queue an analog axis value; only the newest value per tick is applied."""
+        if axis.endswith("trigger"):
+            value = max(0, min(255, value))
+        with self.axis_lock:
+            self.pending_axes[axis] = value
+    
+    def _flush_axes(self):
+        """Apply all pending axis values with a single gamepad update."""
+        with self.axis_lock:
+            if not self.pending_axes:
+                return
+            pending, self.pending_axes = self.pending_axes, {}
+        
+        self.axis_state.update(pending)
+        state = self.axis_state
+        try:
+            with self.gamepad_lock:
+                if "left_x" in pending or "left_y" in pending:
+                    self.gamepad.left_joystick(x_value=state["left_x"], y_value=state["left_y"])
+                if "right_x" in pending or "right_y" in pending:
+                    self.gamepad.right_joystick(x_value=state["right_x"], y_value=state["right_y"])
+                if "left_trigger" in pending:
+                    self.gamepad.left_trigger(value=state["left_trigger"])
+                if "right_trigger" in pending:
+                    self.gamepad.right_trigger(value=state["right_trigger"])
                 self.gamepad.update()
         except Exception as e:
-            self._update_status(f"Error sending gamepad action {kind} {value}: {e}")
+            self._update_status(f"Error applying analog input: {e}")
     
-    def start(self):
-        """Start the gamepad server."""
+    def _update_loop(self):
+        """Push coalesced analog state to the gamepad at a fixed rate."""
+        interval = 1.0 / self.update_rate
+        next_tick = time.perf_counter()
+        while self.running:
+            self._flush_axes()
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()
+    
+    def listen(self):
+        """Bind the listening socket. Raises OSError if the port cannot be bound."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if platform.system() != 'Windows':
+                # Allow a stopped session's port to be reused right away
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.HOST, self.port))
+            sock.listen(1)
+        except OSError:
+            sock.close()
+            raise
+        self.socket = sock
         self.running = True
-        self.gamepad = vg.VX360Gamepad()
-        self.esc_buf = ""
-        
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind((self.HOST, self.PORT))
-        self.socket.listen(1)
-        
-        self._update_status(f"Listening on {self.HOST}:{self.PORT}...")
+        self._update_status(f"Listening on {self.HOST}:{self.port}...")
+    
+    def start(self):
+        """Start the gamepad server, binding first unless listen() already did."""
+        if self.socket is not None and not self.running:
+            # Stopped before this thread got going
+            return
         
         try:
+            if self.socket is None:
+                self.listen()
+            
+            self.gamepad = vg.VX360Gamepad()
+            self.decoder.reset()
+            self.pending_axes = {}
+            self.axis_state = {axis: 0 for axis in self.AXIS_MAP.values()}
+            
+            self.update_thread = threading.Thread(target=self._update_loop, daemon=True)
+            self.update_thread.start()
+            self.presses.start()
+            
+            self.stamp = None
+            if self.jitter:
+                self.jitter.reset()
+                self.jitter.start()
+            
             self.conn, addr = self.socket.accept()
+            self.client_addr = addr
             self._update_status(f"Client connected: {addr}")
             
             while self.running:
-                data = self.conn.recv(1024)
+                with tracer.span("recv", "input"):
+                    data = self.conn.recv(4096)
                 if not data:
                     self._update_status("Client disconnected")
                     break
                 
-                for b in data:
-                    ch = chr(b)
-                    
-                    # Ctrl+C from client -> exit server
-                    if b == 3:
+                # Decode the whole buffer in one pass, then queue its presses in order
+                actions = []
+                stamped = []
+                with tracer.span("decode", "input"):
+                    events = self.decoder.feed(data)
+                for event in events:
+                    kind, value = event
+                    if kind == TIME:
+                        if stamped:
+                            self.jitter.push(self.stamp, stamped)
+                            stamped = []
+                        self.stamp = value
+                    elif event is QUIT:
+                        # Ctrl+C from client -> exit server
                         self._update_status("Received Ctrl+C, shutting down server.")
                         self.running = False
-                        break
-                    
-                    # Handle escape sequences
-                    if self.esc_buf:
-                        self.esc_buf += ch
-                        if self.esc_buf in self.ESC_MAP:
-                            direction = self.ESC_MAP[self.esc_buf]
-                            self.press_gamepad_action("dpad", direction)
-                            self.esc_buf = ""
-                            continue
-                        if not any(seq.startswith(self.esc_buf) for seq in self.ESC_MAP):
-                            self.esc_buf = ""
-                        continue
-                    
-                    # Start of escape sequence
-                    if ch == "\x1b":
-                        self.esc_buf = ch
-                        continue
-                    
-                    # Ignore newlines/carriage returns
-                    if ch in ("\n", "\r"):
-                        continue
-                    
-                    # Normal mapped keys
-                    if ch in self.CHAR_MAP:
-                        kind, value = self.CHAR_MAP[ch]
-                        self.press_gamepad_action(kind, value)
+                    elif self.jitter and self.stamp is not None:
+                        stamped.append(event)
+                    elif kind == AXIS:
+                        self.set_axis(*value)
+                    else:
+                        actions.append(event)
+                
+                if stamped:
+                    self.jitter.push(self.stamp, stamped)
+                if actions:
+                    with tracer.span("queue_gamepad_actions", "input"):
+                        self.queue_gamepad_actions(actions)
         except Exception as e:
-            self._update_status(f"Error: {e}")
+            # stop() wakes accept()/recv() with an error; that is not a failure
+            if self.running:
+                self._update_status(f"Error: {e}")
         finally:
             self.stop()
     
     def stop(self):
         """Stop the gamepad server."""
         self.running = False
+        if self.jitter:
+            self.jitter.stop()
+        self.presses.stop()
+        # Let the old update loop finish so a quick listen()/start() cannot run two
+        if self.update_thread and self.update_thread is not threading.current_thread():
+            self.update_thread.join(1)
+        self.client_addr = None
         if self.conn:
             self.conn.close()
         if self.socket:
+            # Closing alone does not wake a thread blocked in accept()
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.socket.close()
         self._update_status("Gamepad server stopped")
 
@@ -151,12 +350,27 @@ class StreamServer:
     
     PORT = 8000
     
-    def __init__(self, status_callback=None):
+    # Maximum age of the cached frame served by /snapshot
+    SNAPSHOT_TTL = 1.0
+    
+    def __init__(self, status_callback=None, use_worker=False, port=None, region=None, cores=None):
         self.status_callback = status_callback
+        self.port = port or self.PORT
+        # Monitor index or {"left", "top", "width", "height"} dict to capture
+        self.region = 1 if region is None else region
+        # CPU cores the capture worker is pinned to
+        self.cores = cores
         self.app = Flask(__name__)
+        self.http_server = None
         self.running = False
         self.thread = None
-        self._thread_local = threading.local()
+        self.use_worker = use_worker
+        self.worker = None
+        
+        # Most recent encoded frame for /snapshot: (captured_at, etag, jpg_bytes)
+        self._snapshot = None
+        self._snapshot_scaled = {}
+        self._snapshot_lock = threading.Lock()
         self._setup_routes()
     
     def _update_status(self, message):
@@ -164,33 +378,108 @@ class StreamServer:
         if self.status_callback:
             self.status_callback(f"Stream Server: {message}")
     
-    def get_sct(self):
-        """Get or create thread-local mss instance."""
-        if not hasattr(self._thread_local, 'sct'):
-            self._thread_local.sct = mss.mss()
-        return self._thread_local.sct
+    def capture_frame(self, sct):
+        """Capture and encode a single JPEG frame in this process with an mss instance."""
+        monitor = sct.monitors[self.region] if isinstance(self.region, int) else self.region
+        
+        with tracer.span("sct.grab", "capture"):
+            shot = sct.grab(monitor)
+        with tracer.span("Image.frombytes", "capture"):
+            img = Image.frombytes('RGB', shot.size, shot.rgb)
+        
+        buf = io.BytesIO()
+        with tracer.span("img.save", "capture"):
+            img.save(buf, format='JPEG', quality=60)
+        return buf.getvalue()
+    
+    def capture_frames(self):
+        """Capture and encode JPEG frames in this process."""
+        # One mss instance per stream, closed when the stream ends
+        with mss.mss() as sct:
+            while self.running:
+                yield self.capture_frame(sct)
+    
+    def _store_snapshot(self, jpg_bytes):
+        """Replace the cached snapshot (caller holds the snapshot lock)."""
+        etag = hashlib.blake2b(jpg_bytes, digest_size=8).hexdigest()
+        if not self._snapshot or self._snapshot[1] != etag:
+            self._snapshot_scaled = {}
+        self._snapshot = (time.monotonic(), etag, jpg_bytes)
+    
+    def _offer_snapshot(self, jpg_bytes):
+        """Refresh the snapshot cache from a streamed frame once it has expired."""
+        snapshot = self._snapshot
+        if snapshot and time.monotonic() - snapshot[0] < self.SNAPSHOT_TTL:
+            return
+        if self._snapshot_lock.acquire(blocking=False):
+            try:
+                self._store_snapshot(jpg_bytes)
+            finally:
+                self._snapshot_lock.release()
+    
+    def get_snapshot(self):
+        """
+        Return (etag, jpg_bytes) for a frame no older than SNAPSHOT_TTL.
+        A new capture only happens when the cached frame has expired.
+        """
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            if not snapshot or time.monotonic() - snapshot[0] >= self.SNAPSHOT_TTL:
+                if self.worker:
+                    jpg_bytes = self.worker.next_frame()
+                else:
+                    with mss.mss() as sct:
+                        jpg_bytes = self.capture_frame(sct)
+                if jpg_bytes is None:
+                    if not snapshot:
+                        raise RuntimeError("No frame available from capture worker")
+                    jpg_bytes = snapshot[2]
+                self._store_snapshot(jpg_bytes)
+            _, etag, jpg_bytes = self._snapshot
+            return etag, jpg_bytes
+    
+    def _scaled_snapshot(self, etag, jpg_bytes, width):
+        """Downscale a snapshot to width, reusing earlier results for the same frame."""
+        with self._snapshot_lock:
+            cached = self._snapshot_scaled.get((etag, width))
+        if cached is not None:
+            return cached
+        
+        img = Image.open(io.BytesIO(jpg_bytes))
+        if width < img.width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.BILINEAR)
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=60)
+            scaled = buf.getvalue()
+        else:
+            scaled = jpg_bytes
+        
+        with self._snapshot_lock:
+            if self._snapshot and self._snapshot[1] == etag:
+                self._snapshot_scaled[(etag, width)] = scaled
+        return scaled
     
     def generate_frames(self):
         """Generate video frames from screen capture."""
-        sct = self.get_sct()
-        monitor = sct.monitors[1]  # usually main screen
+        frames = self.worker.frames() if self.worker else self.capture_frames()
         
-        while self.running:
-            try:
-                shot = sct.grab(monitor)
-                img = Image.frombytes('RGB', shot.size, shot.rgb)
-                
-                buf = io.BytesIO()
-                img.save(buf, format='JPEG', quality=60)
-                jpg_bytes = buf.getvalue()
-                
-                yield (
-                    b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + jpg_bytes + b'\r\n'
-                )
-            except Exception as e:
-                self._update_status(f"Frame generation error: {e}")
-                break
+        try:
+            for jpg_bytes in frames:
+                if not self.running:
+                    break
+                self._offer_snapshot(jpg_bytes)
+                # Werkzeug writes the chunk to the socket before resuming us
+                with tracer.span("yield/write", "stream"):
+                    yield (
+                        b'--frame\r\n'
+                        b'Content-Type: image/jpeg\r\n\r\n' + jpg_bytes + b'\r\n'
+                    )
+        except Exception as e:
+            self._update_status(f"Frame generation error: {e}")
+        finally:
+            # Release the capture source as soon as the client goes away
+            frames.close()
     
     def _setup_routes(self):
         """Setup Flask routes."""
@@ -201,6 +490,51 @@ class StreamServer:
                 mimetype='multipart/x-mixed-replace; boundary=frame'
             )
         
+        @self.app.route('/snapshot')
+        def snapshot():
+            width = request.args.get('w')
+            if width is not None:
+                try:
+                    width = int(width)
+                except ValueError:
+                    width = 0
+                if width <= 0:
+                    return Response("Invalid width", status=400, mimetype='text/plain')
+            
+            try:
+                etag, jpg_bytes = self.get_snapshot()
+            except Exception as e:
+                self._update_status(f"Snapshot error: {e}")
+                return Response("Snapshot unavailable", status=503, mimetype='text/plain')
+            
+            tag = etag if width is None else f"{etag}-w{width}"
+            headers = {
+                'ETag': f'"{tag}"',
+                'Cache-Control': f'max-age={int(self.SNAPSHOT_TTL)}',
+            }
+            if tag in request.if_none_match:
+                return Response(status=304, headers=headers)
+            
+            if width is not None:
+                jpg_bytes = self._scaled_snapshot(etag, jpg_bytes, width)
+            return Response(jpg_bytes, mimetype='image/jpeg', headers=headers)
+        
+        @self.app.route('/trace')
+        def trace():
+            return jsonify(tracer.export_chrome())
+        
+        @self.app.route('/trace/start', methods=['POST'])
+        def trace_start():
+            tracer.start()
+            self._update_status("Tracing enabled")
+            return jsonify(enabled=True)
+        
+        @self.app.route('/trace/stop', methods=['POST'])
+        def trace_stop():
+            tracer.stop()
+            self._update_status("Tracing disabled")
+            return jsonify(enabled=False)
+        
         @self.app.route('/')
         def index():
             return """
@@ -214,22 +548,47 @@ class StreamServer:
     def _run_flask(self):
         """Run Flask server in a thread."""
         try:
-            self._update_status(f"Starting stream server on port {self.PORT}...")
-            self.app.run(host="0.0.0.0", port=self.PORT, threaded=False, use_reloader=False)
+            self.http_server.serve_forever()
         except Exception as e:
             self._update_status(f"Stream server error: {e}")
         finally:
             self.running = False
     
     def start(self):
-        """Start the stream server in a separate thread."""
-        if not self.running:
-            self.running = True
-            self.thread = threading.Thread(target=self._run_flask, daemon=True)
-            self.thread.start()
+        """
+        Start the stream server in a separate thread.
+        The port is bound before returning; raises if it or the capture worker fails.
+        """
+        if self.running:
+            return
+        
+        self.running = True
+        try:
+            if self.use_worker:
+                self.worker = CaptureWorker(
+                    status_callback=self.status_callback,
+                    region=self.region,
+                    cores=self.cores
+                )
+                self.worker.start()
+            self._update_status(f"Starting stream server on port {self.port}...")
+            self.http_server = make_server("0.0.0.0", self.port, self.app, threaded=True)
+        except Exception:
+            self.stop()
+            raise
+        
+        self.thread = threading.Thread(target=self._run_flask, daemon=True)
+        self.thread.start()
     
     def stop(self):
         """Stop the stream server."""
         self.running = False
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
         self._update_status("Stream server stopped")
 
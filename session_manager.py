@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Host many isolated gamepad/stream sessions on one machine."""
+import argparse
+import os
+import platform
+import socket
+import threading
+import time
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+from server_modules import GamepadServer, StreamServer
+from capture_worker import pin_process
+
+
+class Session:
+    """One isolated pair of gamepad and stream servers."""
+
+    def __init__(self, session_id, gamepad_port, stream_port, region, cores, status_callback=None,
+                 on_failure=None):
+        self.session_id = session_id
+        self.gamepad_port = gamepad_port
+        self.stream_port = stream_port
+        self.region = region
+        self.cores = cores
+        self.status_callback = status_callback
+        # Called with the session once it can no longer accept gamepad clients
+        self.on_failure = on_failure
+        self.created_at = time.time()
+        self.gamepad_thread = None
+        self.active = False
+        self.clients_served = 0
+        self.lock = threading.Lock()
+
+        self.gamepad_server = GamepadServer(status_callback=self._update_status, port=gamepad_port)
+        self.stream_server = StreamServer(
+            status_callback=self._update_status,
+            use_worker=True,
+            port=stream_port,
+            region=region,
+            cores=cores
+        )
+
+    def _update_status(self, message):
+        """Update status via callback if available."""
+        if self.status_callback:
+            self.status_callback(f"Session {self.session_id}: {message}")
+
+    def start(self):
+        """
+        Start both servers; each owns its own virtual gamepad and capture worker.
+        Both ports are bound before returning; on failure everything is stopped again.
+        """
+        try:
+            self.stream_server.start()
+            self.gamepad_server.listen()
+        except Exception:
+            self.stop()
+            raise
+        self.active = True
+        self.gamepad_thread = threading.Thread(target=self._serve_gamepad, daemon=True)
+        self.gamepad_thread.start()
+
+    def _serve_gamepad(self):
+        """Serve gamepad clients one after another until the session is stopped."""
+        while True:
+            # Returns once the client disconnects (or sends Ctrl+C)
+            self.gamepad_server.start()
+            with self.lock:
+                if not self.active:
+                    return
+                self.clients_served += 1
+                try:
+                    self.gamepad_server.listen()
+                    continue
+                except OSError as e:
+                    self._update_status(f"Could not listen for the next client: {e}")
+            break
+
+        # Outside the lock: on_failure normally calls stop() through the manager
+        if self.on_failure:
+            self.on_failure(self)
+        else:
+            self.stop()
+
+    def stop(self):
+        """Stop both servers."""
+        with self.lock:
+            self.active = False
+            self.gamepad_server.stop()
+        self.stream_server.stop()
+
+    def info(self):
+        """Describe the session and its current resource usage."""
+        worker = self.stream_server.worker
+        client = self.gamepad_server.client_addr
+        if client:
+            gamepad_state = "connected"
+        elif self.gamepad_server.running:
+            gamepad_state = "waiting"
+        else:
+            gamepad_state = "stopped"
+        return {
+            "id": self.session_id,
+            "gamepad_port": self.gamepad_port,
+            "stream_port": self.stream_port,
+            "region": self.region,
+            "cores": sorted(self.cores) if self.cores else None,
+            "uptime_seconds": round(time.time() - self.created_at, 1),
+            "gamepad_running": self.gamepad_server.running,
+            "gamepad_state": gamepad_state,
+            "gamepad_client": f"{client[0]}:{client[1]}" if client else None,
+            "clients_served": self.clients_served,
+            "stream_running": self.stream_server.running,
+            "worker": worker.usage() if worker else None,
+        }
+
+
+class SessionManager:
+    """Start and stop sessions, handing out ports and CPU cores from fixed pools."""
+
+    GAMEPAD_PORTS = range(5001, 5017)
+    STREAM_PORTS = range(8000, 8016)
+    CONTROL_PORT = 7000
+    CORES_PER_SESSION = 1
+    # Cores kept free for input handling and the control API
+    RESERVED_CORES = 1
+
+    def __init__(self, status_callback=None, gamepad_ports=None, stream_ports=None,
+                 cores_per_session=None, reserved_cores=None):
+        self.status_callback = status_callback
+        self.gamepad_ports = list(gamepad_ports or self.GAMEPAD_PORTS)
+        self.stream_ports = list(stream_ports or self.STREAM_PORTS)
+        self.cores_per_session = cores_per_session or self.CORES_PER_SESSION
+        reserved = self.RESERVED_CORES if reserved_cores is None else reserved_cores
+        available = self._available_cores()
+        self.reserved_cores = set(available[:reserved])
+        self.cores = available[reserved:]
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._next_id = 1
+        self.app = Flask(__name__)
+        self.http_server = None
+        self._setup_routes()
+        self._pin_self()
+
+    def _pin_self(self):
+        """Keep this process (input handling and the control API) on the reserved cores."""
+        if not self.reserved_cores:
+            return
+        try:
+            if not pin_process(os.getpid(), self.reserved_cores):
+                self._update_status("CPU pinning is not supported on this platform")
+        except (OSError, ValueError) as e:
+            self._update_status(f"Could not pin manager to cores {sorted(self.reserved_cores)}: {e}")
+
+    def _update_status(self, message):
+        """Update status via callback if available."""
+        if self.status_callback:
+            self.status_callback(f"Session Manager: {message}")
+
+    @staticmethod
+    def _available_cores():
+        """CPU cores this process may run on."""
+        if hasattr(os, "sched_getaffinity"):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(os.cpu_count() or 1))
+
+    @staticmethod
+    def _port_free(port):
+        """Check whether a TCP port can currently be bound the way the session servers bind it."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            if platform.system() != 'Windows':
+                # Like GamepadServer and werkzeug, so ports in TIME_WAIT count as free
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                s.bind(("0.0.0.0", port))
+                return True
+            except OSError:
+                return False
+
+    def _allocate(self, pool, in_use):
+        """First free port from pool that is neither assigned nor bound elsewhere."""
+        for port in pool:
+            if port not in in_use and self._port_free(port):
+                return port
+        return None
+
+    def _allocate_cores(self):
+        """Take a block of cores not used by any session (caller holds the lock)."""
+        used = set()
+        for session in self.sessions.values():
+            used.update(session.cores)
+        free = [core for core in self.cores if core not in used]
+        if len(free) < self.cores_per_session:
+            return None
+        return set(free[:self.cores_per_session])
+
+    def create_session(self, region=None):
+        """
+        Start a new session capturing region (monitor index or rect dict).
+        Raises RuntimeError when no ports or cores are left or the session fails
+        to start. The session is only registered once it has started.
+        """
+        # Held across start() so concurrent creates cannot pick the same ports or cores
+        with self.lock:
+            gamepad_port = self._allocate(
+                self.gamepad_ports, {s.gamepad_port for s in self.sessions.values()}
+            )
+            stream_port = self._allocate(
+                self.stream_ports, {s.stream_port for s in self.sessions.values()}
+            )
+            if gamepad_port is None or stream_port is None:
+                raise RuntimeError("No free ports left in the session port pool")
+            cores = self._allocate_cores()
+            if cores is None:
+                raise RuntimeError("No free CPU cores left for another session")
+
+            session_id = str(self._next_id)
+            self._next_id += 1
+            session = Session(
+                session_id, gamepad_port, stream_port, region, cores,
+                status_callback=self.status_callback,
+                on_failure=self._session_failed
+            )
+            try:
+                session.start()
+            except Exception as e:
+                raise RuntimeError(f"Could not start session {session_id}: {e}") from e
+            self.sessions[session_id] = session
+
+        self._update_status(
+            f"Started session {session_id} (gamepad {gamepad_port}, stream {stream_port}, "
+            f"cores {sorted(cores)})"
+        )
+        return session
+
+    def kill_session(self, session_id):
+        """Stop a session and return its ports and cores to the pools."""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.stop()
+        self._update_status(f"Stopped session {session_id}")
+        return True
+
+    def _session_failed(self, session):
+        """Drop a session that can no longer accept clients, freeing its ports and cores."""
+        self._update_status(f"Session {session.session_id} can no longer accept clients")
+        if not self.kill_session(session.session_id):
+            # Not registered (yet or any more): just make sure it is stopped
+            session.stop()
+
+    def list_sessions(self):
+        """Info for every running session."""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return [session.info() for session in sessions]
+
+    def _setup_routes(self):
+        """Setup control API routes."""
+        @self.app.route('/sessions', methods=['GET'])
+        def list_sessions():
+            return jsonify(sessions=self.list_sessions())
+
+        @self.app.route('/sessions', methods=['POST'])
+        def create_session():
+            body = request.get_json(silent=True) or {}
+            region = body.get('region')
+            if region is not None and not isinstance(region, (int, dict)):
+                return jsonify(error="region must be a monitor index or a rect"), 400
+            try:
+                session = self.create_session(region=region)
+            except RuntimeError as e:
+                return jsonify(error=str(e)), 503
+            return jsonify(session.info()), 201
+
+        @self.app.route('/sessions/<session_id>', methods=['GET'])
+        def get_session(session_id):
+            session = self.sessions.get(session_id)
+            if session is None:
+                return jsonify(error="Unknown session"), 404
+            return jsonify(session.info())
+
+        @self.app.route('/sessions/<session_id>', methods=['DELETE'])
+        def kill_session(session_id):
+            if not self.kill_session(session_id):
+                return jsonify(error="Unknown session"), 404
+            return "", 204
+
+    def serve(self, port=None):
+        """Serve the control API until shutdown() is called."""
+        port = port or self.CONTROL_PORT
+        self.http_server = make_server("0.0.0.0", port, self.app, threaded=True)
+        self._update_status(f"Control API listening on port {port}")
+        self.http_server.serve_forever()
+
+    def shutdown(self):
+        """Stop the control API and every session."""
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        for session_id in list(self.sessions):
+            self.kill_session(session_id)
+
+
+def parse_region(value):
+    """Parse a --region value: a monitor index or "left,top,width,height"."""
+    parts = value.split(",")
+    try:
+        if len(parts) == 1:
+            return int(parts[0])
+        if len(parts) == 4:
+            left, top, width, height = (int(p) for p in parts)
+            return {"left": left, "top": top, "width": width, "height": height}
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid region {value!r}")
+
+
+def main():
+    """Run a headless session host."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=SessionManager.CONTROL_PORT,
+                        help="control API port")
+    parser.add_argument("--sessions", type=int, default=0,
+                        help="number of sessions to start immediately")
+    parser.add_argument("--region", type=parse_region, action="append", default=[],
+                        help="capture region for one startup session: monitor index or "
+                             "left,top,width,height (repeat once per session)")
+    parser.add_argument("--cores-per-session", type=int, default=SessionManager.CORES_PER_SESSION)
+    args = parser.parse_args()
+
+    manager = SessionManager(status_callback=print, cores_per_session=args.cores_per_session)
+    # Sessions beyond the given regions capture monitor 1
+    for i in range(max(args.sessions, len(args.region))):
+        region = args.region[i] if i < len(args.region) else None
+        try:
+            manager.create_session(region=region)
+        except RuntimeError as e:
+            print(e)
+    try:
+        manager.serve(args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
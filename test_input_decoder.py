@@ -0,0 +1,93 @@
+"""Tests for the precompiled input decoder."""
+import pytest
+from input_decoder import InputDecoder, validate_profile, QUIT
+
+
+CHAR_MAP = {"w": ("dpad", "up"), "a": ("dpad", "left"), "d": ("dpad", "right")}
+ESC_MAP = {"\x1b[A": ("dpad", "up"), "\x1b[B": ("dpad", "down")}
+AXIS_MAP = {"x": "left_x"}
+
+
+def make_decoder(char_map=CHAR_MAP, esc_map=ESC_MAP):
+    return InputDecoder(char_map, esc_map, AXIS_MAP)
+
+
+def test_plain_keys_and_escapes():
+    decoder = make_decoder()
+    assert decoder.feed(b"w\x1b[Bz\x1bMx8000") == [
+        ("dpad", "up"), ("dpad", "down"), ("axis", ("left_x", -32768)),
+    ]
+
+
+def test_sequences_split_across_buffers():
+    decoder = make_decoder()
+    assert decoder.feed(b"\x1b[") == []
+    assert decoder.feed(b"A\x1bMx7f") == [("dpad", "up")]
+    assert decoder.feed(b"ffw") == [("axis", ("left_x", 32767)), ("dpad", "up")]
+
+
+def test_ctrl_c_stops_decoding():
+    decoder = make_decoder()
+    assert decoder.feed(b"w\x1b[\x03w") == [("dpad", "up"), QUIT]
+    assert decoder.feed(b"A") == []
+
+
+@pytest.mark.parametrize("esc_map", [
+    {"\x1b[": ("dpad", "up"), "\x1b[A": ("dpad", "down")},
+    {"\x1b[A": ("dpad", "down"), "\x1b[": ("dpad", "up")},
+])
+def test_overlapping_escapes_rejected_in_any_order(esc_map):
+    with pytest.raises(ValueError):
+        make_decoder(esc_map=esc_map)
+
+
+@pytest.mark.parametrize("esc_map", [
+    {"\x1bM": ("dpad", "up")},
+    {"\x1bMx": ("dpad", "up")},
+    {"\x1bT": ("dpad", "up")},
+    {"\x1b": ("dpad", "up")},
+])
+def test_reserved_escapes_rejected(esc_map):
+    with pytest.raises(ValueError):
+        make_decoder(esc_map=esc_map)
+
+
+@pytest.mark.parametrize("key", ["\x03", "\x1b", "ab", ""])
+def test_reserved_or_invalid_keys_rejected(key):
+    with pytest.raises(ValueError):
+        make_decoder(char_map={key: ("dpad", "up")})
+
+
+@pytest.mark.parametrize("profile", [
+    [],
+    {"keys": []},
+    {"keys": {"ab": "button A"}},
+    {"keys": {"": "button A"}},
+    {"keys": {"w": 3}},
+    {"escapes": ["\x1b[A"]},
+])
+def test_invalid_profiles_rejected(profile):
+    with pytest.raises(ValueError):
+        validate_profile(profile)
+
+
+def stamp(us):
+    return b"\x1bT%012x" % us
+
+
+def test_stamped_arrow_key():
+    decoder = make_decoder()
+    assert decoder.feed(stamp(0xADADAD) + b"\x1b[A") == [("time", 0xADADAD), ("dpad", "up")]
+
+
+def test_stamped_lone_escape_then_key():
+    decoder = make_decoder()
+    events = decoder.feed(stamp(0xADA) + b"\x1b" + stamp(0xDAD) + b"w")
+    assert events == [("time", 0xADA), ("time", 0xDAD), ("dpad", "up")]
+
+
+def test_stamp_inside_unfinished_sequence_restarts_cleanly():
+    decoder = make_decoder()
+    assert decoder.feed(b"\x1b[" + stamp(0xDDD) + b"\x1b[B") == [("time", 0xDDD), ("dpad", "down")]
+    # A header cut short by a new one is dropped without leaking digits as keys
+    assert decoder.feed(b"\x1bTadad" + stamp(0xAAA) + b"d") == [("time", 0xAAA), ("dpad", "right")]
@@ -0,0 +1,104 @@
+"""Tests for the input jitter buffer and ordered button taps."""
+import threading
+import time
+from jitter_buffer import JitterBuffer
+from press_queue import PressQueue
+
+
+def now_us():
+    return int(time.monotonic() * 1e6)
+
+
+def wait_for(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+class Recorder:
+    """Collects applied batches / button changes with their arrival time."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def apply(self, *args):
+        with self.lock:
+            self.calls.append((time.monotonic(),) + args)
+        return True
+
+
+def test_events_applied_in_order_after_delay():
+    recorder = Recorder()
+    buffer = JitterBuffer(recorder.apply, min_delay=0.02, max_delay=0.02)
+    buffer.start()
+    try:
+        pushed_at = time.monotonic()
+        assert buffer.push(now_us(), ["a", "b"])
+        assert buffer.push(now_us(), ["c"])
+        assert wait_for(lambda: buffer.stats()["applied"] == 3)
+    finally:
+        buffer.stop()
+    applied = [event for call in recorder.calls for event in call[1]]
+    assert applied == ["a", "b", "c"]
+    assert recorder.calls[0][0] - pushed_at >= 0.015
+
+
+def test_late_events_are_dropped_and_counted():
+    recorder = Recorder()
+    buffer = JitterBuffer(recorder.apply, min_delay=0.005, max_delay=0.005)
+    buffer.start()
+    try:
+        sent = now_us()
+        assert buffer.push(sent, ["on time"])
+        time.sleep(0.05)
+        # Stamped 1 ms after the first event but arriving ~50 ms later
+        assert not buffer.push(sent + 1000, ["late", "too"])
+        assert wait_for(lambda: buffer.stats()["applied"] == 1)
+    finally:
+        buffer.stop()
+    assert buffer.stats()["late_drops"] == 2
+    assert [call[1] for call in recorder.calls] == [["on time"]]
+
+
+def test_stop_discards_queued_events():
+    recorder = Recorder()
+    buffer = JitterBuffer(recorder.apply, min_delay=0.1, max_delay=0.1)
+    buffer.start()
+    buffer.push(now_us(), ["dropped"])
+    buffer.stop()
+    time.sleep(0.15)
+    assert recorder.calls == []
+
+
+def test_buffered_taps_closer_than_tap_duration_stay_separate():
+    recorder = Recorder()
+    presses = PressQueue(recorder.apply, duration=0.05)
+    buffer = JitterBuffer(presses.put, min_delay=0.01, max_delay=0.01)
+    presses.start()
+    buffer.start()
+    try:
+        # Two taps of the same button 20 ms apart, less than one tap duration
+        assert buffer.push(now_us(), ["up"])
+        time.sleep(0.02)
+        assert buffer.push(now_us(), ["up"])
+        assert wait_for(lambda: len(recorder.calls) == 4)
+    finally:
+        buffer.stop()
+        presses.stop()
+    assert [(btn, pressed) for _, btn, pressed in recorder.calls] == [
+        ("up", True), ("up", False), ("up", True), ("up", False),
+    ]
+    first_release, second_press = recorder.calls[1][0], recorder.calls[2][0]
+    assert second_press >= first_release
+
+
+def test_press_queue_stop_releases_held_button_and_drops_pending():
+    recorder = Recorder()
+    presses = PressQueue(recorder.apply, duration=0.05)
+    presses.start()
+    presses.put(["a", "b", "c"])
+    assert wait_for(lambda: len(recorder.calls) == 1)
+    presses.stop()
+    assert [(btn, pressed) for _, btn, pressed in recorder.calls] == [("a", True), ("a", False)]
@@ -0,0 +1,101 @@
+"""Opt-in span tracing with Chrome trace-event export."""
+import collections
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    """Span returned while tracing is disabled; does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Times a block and records it as a complete event on exit."""
+
+    __slots__ = ("tracer", "name", "cat", "start")
+
+    def __init__(self, tracer, name, cat):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        self.tracer._events.append(
+            (self.name, self.cat, self.start, end - self.start, threading.get_ident())
+        )
+        return False
+
+
+class Tracer:
+    """
+    Records timing spans into a bounded in-memory ring.
+
+    Tracing is off by default; while off, span() returns a shared no-op
+    context manager so instrumented code pays only for the call.
+    """
+
+    CAPACITY = 100000
+
+    def __init__(self, capacity=None):
+        self.enabled = False
+        self._events = collections.deque(maxlen=capacity or self.CAPACITY)
+
+    def span(self, name, cat="default"):
+        """Context manager timing the enclosed block as one span."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat)
+
+    def start(self):
+        """Clear previously recorded spans and start recording."""
+        self._events.clear()
+        self.enabled = True
+
+    def stop(self):
+        """Stop recording; recorded spans stay available for export."""
+        self.enabled = False
+
+    def clear(self):
+        """Drop all recorded spans."""
+        self._events.clear()
+
+    def export_chrome(self):
+        """Return recorded spans as a Chrome trace-event JSON object."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start / 1000.0,
+                "dur": dur / 1000.0,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, cat, start, dur, tid in list(self._events)
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        """Write recorded spans to path as Chrome trace-event JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.export_chrome(), f)
+
+
+# Shared tracer used by the servers and the GUI
+tracer = Tracer()